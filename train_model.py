@@ -1,83 +1,159 @@
 import tensorflow as tf
 from tensorflow.keras import layers, models
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
 import matplotlib.pyplot as plt
-import os
 
 # Define image parameters
 IMAGE_SIZE = (224, 224)
 BATCH_SIZE = 32
 EPOCHS = 5
+# Extra epochs with the pretrained backbone unfrozen at a low learning rate
+FINE_TUNE_EPOCHS = 5
+# Also export a full-integer TF-Lite model (for ARM/edge; often slower on x86).
+# main.py serves it only when started with
+# TFLITE_MODEL_PATH=ml_models/trained_model_int8.tflite
+EXPORT_INT8 = False
 
-# Create data generators
-# This is a powerful feature of Keras that loads and preprocesses images
-# directly from your directory structure.
-train_datagen = ImageDataGenerator(
-    rescale=1./255, # Normalize pixel values to 0-1
-    rotation_range=20,
-    width_shift_range=0.2,
-    height_shift_range=0.2,
-    shear_range=0.2,
-    zoom_range=0.2,
-    horizontal_flip=True,
-    fill_mode='nearest'
-)
-
-val_datagen = ImageDataGenerator(rescale=1./255)
+# Train in mixed float16 on GPUs (tensor cores, half the activation memory).
+# CPUs have no fast float16 path, so they stay in float32.
+if tf.config.list_physical_devices('GPU'):
+    tf.keras.mixed_precision.set_global_policy('mixed_float16')
 
 # Load data from directories
 # This will automatically find the classes based on your folder names
-train_generator = train_datagen.flow_from_directory(
+train_ds = tf.keras.utils.image_dataset_from_directory(
     './plant_dataset/train',
-    target_size=IMAGE_SIZE,
+    image_size=IMAGE_SIZE,
     batch_size=BATCH_SIZE,
-    class_mode='categorical'
+    label_mode='categorical'
 )
 
-val_generator = val_datagen.flow_from_directory(
+val_ds = tf.keras.utils.image_dataset_from_directory(
     './plant_dataset/val',
-    target_size=IMAGE_SIZE,
+    image_size=IMAGE_SIZE,
     batch_size=BATCH_SIZE,
-    class_mode='categorical'
+    label_mode='categorical',
+    shuffle=False
 )
 
-# Build the CNN model
-num_classes = len(train_generator.class_indices)
-
-model = models.Sequential([
-    # Convolutional layers to extract features
-    layers.Conv2D(32, (3, 3), activation='relu', input_shape=(224, 224, 3)),
-    layers.MaxPooling2D((2, 2)),
-    layers.Conv2D(64, (3, 3), activation='relu'),
-    layers.MaxPooling2D((2, 2)),
-    layers.Conv2D(128, (3, 3), activation='relu'),
-    layers.MaxPooling2D((2, 2)),
-    
-    # Flatten layer to prepare for classification
-    layers.Flatten(),
-    
-    # Dense layers for classification
-    layers.Dense(128, activation='relu'),
-    layers.Dropout(0.5), # Dropout for regularization
-    layers.Dense(num_classes, activation='softmax')
+num_classes = len(train_ds.class_names)
+
+# Random augmentation as TF ops, run in parallel with training.
+# Kept out of the model so the saved/exported graph stays deterministic.
+augmentation = models.Sequential([
+    layers.RandomFlip('horizontal'),
+    layers.RandomRotation(20 / 360, fill_mode='nearest'),
+    layers.RandomTranslation(0.2, 0.2, fill_mode='nearest'),
+    layers.RandomZoom(0.2, fill_mode='nearest')
 ])
 
+def rescale(images, labels):
+    # Normalize pixel values to 0-1, matching main.py's preprocessing
+    return images / 255.0, labels
+
+AUTOTUNE = tf.data.AUTOTUNE
+# Decoded, resized images are cached one sample at a time after the first
+# epoch, then shuffled and re-batched so batch membership changes every
+# epoch. Augmentation runs after the cache so each epoch sees new variations.
+train_ds = (
+    train_ds.map(rescale, num_parallel_calls=AUTOTUNE)
+    .unbatch()
+    .cache()
+    .shuffle(1000)
+    .batch(BATCH_SIZE)
+    .map(lambda x, y: (augmentation(x, training=True), y), num_parallel_calls=AUTOTUNE)
+    .prefetch(AUTOTUNE)
+)
+val_ds = val_ds.map(rescale, num_parallel_calls=AUTOTUNE).cache().prefetch(AUTOTUNE)
+
+# Build the model on an ImageNet-pretrained MobileNetV3 feature extractor
+# Layers take their dtype from the global policy in effect when this runs
+def build_model(weights='imagenet'):
+    backbone = tf.keras.applications.MobileNetV3Small(
+        input_shape=(224, 224, 3),
+        include_top=False,
+        weights=weights,
+        include_preprocessing=False
+    )
+
+    inputs = layers.Input(shape=(224, 224, 3))
+    # Inputs arrive in 0-1 (as main.py sends them); MobileNetV3 expects -1 to 1
+    x = layers.Rescaling(2.0, offset=-1.0)(inputs)
+    # training=False keeps BatchNorm statistics frozen, also while fine-tuning
+    x = backbone(x, training=False)
+    x = layers.GlobalAveragePooling2D()(x)
+    x = layers.Dropout(0.2)(x) # Dropout for regularization
+    # Softmax kept in float32 for numerical stability under mixed precision
+    outputs = layers.Dense(num_classes, activation='softmax', dtype='float32')(x)
+    return models.Model(inputs, outputs), backbone
+
+model, backbone = build_model()
+backbone.trainable = False # Train only the new head at first
+
 # Compile the model
 model.compile(optimizer='adam',
               loss='categorical_crossentropy',
               metrics=['accuracy'])
 
-# Train the model
+# Train the classification head
 history = model.fit(
-    train_generator,
+    train_ds,
     epochs=EPOCHS,
-    validation_data=val_generator
+    validation_data=val_ds
 )
 
+# Fine-tune the whole network with a small learning rate
+if FINE_TUNE_EPOCHS:
+    backbone.trainable = True
+    model.compile(optimizer=tf.keras.optimizers.Adam(1e-5),
+                  loss='categorical_crossentropy',
+                  metrics=['accuracy'])
+    fine_tune_history = model.fit(
+        train_ds,
+        epochs=EPOCHS + FINE_TUNE_EPOCHS,
+        initial_epoch=EPOCHS,
+        validation_data=val_ds
+    )
+    for metric, values in fine_tune_history.history.items():
+        history.history[metric] += values
+
+# The .h5 stores each layer's dtype policy, so a mixed_float16 model would
+# still compute in float16 on main.py's CPU-only server. Rebuild it in
+# float32 and copy the trained weights (variables are float32 either way).
+if tf.keras.mixed_precision.global_policy().name != 'float32':
+    tf.keras.mixed_precision.set_global_policy('float32')
+    trained_model, trained_backbone = model, backbone
+    model, backbone = build_model(weights=None)
+    # Matching trainable flags keeps get_weights() in the same order
+    backbone.trainable = trained_backbone.trainable
+    model.set_weights(trained_model.get_weights())
+
 # Save the trained model
 model.save('ml_models/trained_model.h5')
 print("Model saved to ml_models/trained_model.h5")
 
+# Export a float16-quantized TF-Lite copy for CPU inference
+# Weights are stored as float16 (half the size) with negligible accuracy loss.
+converter = tf.lite.TFLiteConverter.from_keras_model(model)
+converter.optimizations = [tf.lite.Optimize.DEFAULT]
+converter.target_spec.supported_types = [tf.float16]
+with open('ml_models/trained_model.tflite', 'wb') as f:
+    f.write(converter.convert())
+print("TF-Lite model saved to ml_models/trained_model.tflite")
+
+if EXPORT_INT8:
+    # Calibrate activation ranges on a few validation batches
+    def representative_dataset():
+        for images, _ in val_ds.take(10):
+            for image in images:
+                yield [image[None, ...]]
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    with open('ml_models/trained_model_int8.tflite', 'wb') as f:
+        f.write(converter.convert())
+    print("TF-Lite model saved to ml_models/trained_model_int8.tflite")
+
 # Plot training history (optional)
 # This helps you visualize how the model performed during training.
 acc = history.history['accuracy']
@@ -85,7 +161,7 @@ val_acc = history.history['val_accuracy']
 loss = history.history['loss']
 val_loss = history.history['val_loss']
 
-epochs_range = range(EPOCHS)
+epochs_range = range(len(acc))
 
 plt.figure(figsize=(8, 8))
 plt.subplot(1, 2, 1)
@@ -1,9 +1,12 @@
 import os
 import sqlite3
+import threading
+import time
 from datetime import datetime, timezone
 from flask import Flask, request, jsonify
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # SQLite database file
 DB = "farmer_data.db"
@@ -13,6 +16,21 @@ OPENWEATHER_API_KEY = os.environ.get("OPENWEATHER_API_KEY")
 if not OPENWEATHER_API_KEY:
     raise RuntimeError("Set OPENWEATHER_API_KEY environment variable first.")
 
+# Shared HTTP session so OpenWeather calls reuse pooled TCP/TLS connections
+session = requests.Session()
+session.mount("https://", HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=50,
+    max_retries=Retry(total=2, backoff_factor=0.2)
+))
+
+# OpenWeather refreshes roughly every 10 minutes, so nearby lookups
+# (lat/lon rounded to ~1 km) within that window share one response
+WEATHER_CACHE_TTL = 600
+WEATHER_CACHE_MAXSIZE = 4096
+_weather_cache = {}
+_weather_cache_lock = threading.Lock()
+
 # Initialize Flask app
 app = Flask(__name__)
 
@@ -20,8 +38,34 @@ app = Flask(__name__)
 def get_db():
     con = sqlite3.connect(DB)
     con.row_factory = sqlite3.Row
+    # The database is in WAL mode (see init_db.py); NORMAL sync is safe there
+    con.execute("PRAGMA synchronous = NORMAL")
     return con
 
+# Helper to fetch current weather, served from the TTL cache when fresh
+def fetch_weather(lat, lon):
+    key = (round(float(lat), 2), round(float(lon), 2))
+    now = time.monotonic()
+    with _weather_cache_lock:
+        entry = _weather_cache.get(key)
+    if entry and entry[0] > now:
+        return entry[1], entry[2]
+
+    base = "https://api.openweathermap.org/data/2.5/weather"
+    params = {"lat": lat, "lon": lon, "appid": OPENWEATHER_API_KEY, "units": "metric"}
+    wresponse = session.get(base, params=params, timeout=10)
+    wresp = wresponse.json()
+
+    # Only cache real observations, not error payloads
+    if wresponse.ok:
+        with _weather_cache_lock:
+            if len(_weather_cache) >= WEATHER_CACHE_MAXSIZE:
+                expired = [k for k, v in _weather_cache.items() if v[0] <= now]
+                for k in expired or list(_weather_cache)[:WEATHER_CACHE_MAXSIZE // 4]:
+                    del _weather_cache[k]
+            _weather_cache[key] = (now + WEATHER_CACHE_TTL, wresp, wresponse.text)
+    return wresp, wresponse.text
+
 # Helper to get current UTC time in ISO format
 def iso_now():
     return datetime.now(timezone.utc).isoformat()
@@ -37,21 +81,11 @@ def save_location_and_weather():
     if lat is None or lon is None:
         return jsonify({"error": "lat and lon required"}), 400
 
-    con = get_db()
-    cur = con.cursor()
     ts = iso_now()
 
-    # Save location
-    cur.execute(
-        "INSERT INTO locations (farmer_id, latitude, longitude, timestamp) VALUES (?,?,?,?)",
-        (farmer_id, float(lat), float(lon), ts)
-    )
-    loc_id = cur.lastrowid
-
-    # Fetch weather from OpenWeather
-    base = "https://api.openweathermap.org/data/2.5/weather"
-    params = {"lat": lat, "lon": lon, "appid": OPENWEATHER_API_KEY, "units": "metric"}
-    wresp = requests.get(base, params=params, timeout=10).json()
+    # Fetch weather from OpenWeather (or the recent-response cache) before
+    # touching the database, so no write lock is held across the HTTP call
+    wresp, raw_json = fetch_weather(lat, lon)
 
     weather = {
         "temp": wresp.get("main", {}).get("temp"),
@@ -60,21 +94,30 @@ def save_location_and_weather():
         "humidity": wresp.get("main", {}).get("humidity"),
         "wind_speed": wresp.get("wind", {}).get("speed"),
         "description": wresp.get("weather", [{}])[0].get("description"),
-        "raw_json": json.dumps(wresp)
+        # Store the body as received instead of re-encoding the parsed dict
+        "raw_json": raw_json
     }
 
-    # Save weather in database
-    cur.execute(
-        """INSERT INTO weather
-           (location_id, temp, feels_like, pressure, humidity, wind_speed, description, raw_json, timestamp)
-           VALUES (?,?,?,?,?,?,?,?,?)""",
-        (loc_id, weather["temp"], weather["feels_like"], weather["pressure"],
-         weather["humidity"], weather["wind_speed"], weather["description"],
-         weather["raw_json"], iso_now())
-    )
-
-    con.commit()
-    con.close()
+    # Save location and weather in one transaction (one commit)
+    con = get_db()
+    try:
+        with con:
+            cur = con.cursor()
+            cur.execute(
+                "INSERT INTO locations (farmer_id, latitude, longitude, timestamp) VALUES (?,?,?,?)",
+                (farmer_id, float(lat), float(lon), ts)
+            )
+            loc_id = cur.lastrowid
+            cur.execute(
+                """INSERT INTO weather
+                   (location_id, temp, feels_like, pressure, humidity, wind_speed, description, raw_json, timestamp)
+                   VALUES (?,?,?,?,?,?,?,?,?)""",
+                (loc_id, weather["temp"], weather["feels_like"], weather["pressure"],
+                 weather["humidity"], weather["wind_speed"], weather["description"],
+                 weather["raw_json"], iso_now())
+            )
+    finally:
+        con.close()
 
     return jsonify({"location_id": loc_id, "weather": weather}), 201
 
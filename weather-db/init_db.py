@@ -4,6 +4,7 @@ DB = "farmer_data.db"
 
 schema = """
 PRAGMA foreign_keys = ON;
+PRAGMA journal_mode = WAL;
 
 CREATE TABLE IF NOT EXISTS locations (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -26,6 +27,8 @@ CREATE TABLE IF NOT EXISTS weather (
     timestamp TEXT NOT NULL,
     FOREIGN KEY(location_id) REFERENCES locations(id) ON DELETE CASCADE
 );
+
+CREATE INDEX IF NOT EXISTS idx_weather_location_id ON weather (location_id);
 """
 
 def init():